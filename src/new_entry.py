@@ -1,18 +1,158 @@
 from workers import DurableObject, Response, handler
 from urllib.parse import urlparse
+from itertools import islice
 import json
+import re
+
+# Prefer orjson where the runtime ships it; response bodies stay str either way
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    _dumps = json.dumps
+    _loads = json.loads
+
+# Durable Object SQL caps bound parameters per statement at 100; each log row binds 5
+_LOG_INSERT_BATCH_ROWS = 20
+
+def _insert_logs_sql(rows):
+    placeholders = ", ".join(["(?, ?, ?, ?, ?)"] * rows)
+    return f"INSERT INTO logs (timestamp, level, service, message, metadata) VALUES {placeholders}"
+
+# Built once so every full batch sends byte-identical SQL the runtime can reuse
+_INSERT_LOGS_BATCH_SQL = _insert_logs_sql(_LOG_INSERT_BATCH_ROWS)
+
+# query_logs returns at most this many rows
+_MAX_LOG_RESULTS = 50
+
+# Tool definitions never change for the life of the worker, so serialize them once
+_TOOLS_DEFS = [
+    {
+        "type": "function",
+        "name": "check_dependencies",
+        "description": "Check status of service dependencies",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "Optional: filter by service name"
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "name": "check_slack", 
+        "description": "Search recent Slack messages from team members",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "Optional: search term to filter messages"
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "name": "check_deployments",
+        "description": "Check recent deployment status and history",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "Optional: filter by service name"
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "name": "query_logs",
+        "description": "Execute SQL query on logs database. Table schema: logs(id INTEGER, timestamp TEXT, level TEXT, service TEXT, message TEXT, metadata TEXT)",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "sql_query": {
+                    "type": "string",
+                    "description": "SQL SELECT query to execute against logs table. Use LIMIT to control result size."
+                }
+            },
+            "required": ["sql_query"]
+        }
+    }
+]
+
+_TOOLS_DEFS_JSON_INDENTED = json.dumps(_TOOLS_DEFS, indent=2)
+_TOOLS_RESPONSE_BODY = _dumps({"tools": _TOOLS_DEFS})
+
+# Clients send "action" as the first key, so it can be read without parsing the body
+_ACTION_RE = re.compile(r'\A\s*\{\s*"action"\s*:\s*"([A-Za-z_]+)"')
+
+def _extract_action(body):
+    """Peek the action from a raw request body, falling back to a full parse"""
+    match = _ACTION_RE.match(body)
+    if match:
+        return match.group(1)
+    return _loads(body).get("action")
+
+# query_logs only accepts statements that start with the SELECT keyword
+_SELECT_RE = re.compile(r"\A\s*SELECT\b", re.IGNORECASE)
+
+# The only request headers the Durable Object cares about when proxying
+_FORWARDED_HEADERS = ("content-type", "authorization")
+
+_BODY_METHODS = frozenset(("POST", "PATCH", "PUT"))
 
 class OnCallEnvironment(DurableObject):
     def __init__(self, ctx, env):
         super().__init__(ctx, env)
-        self._init_db()
+        self._logs_db_ready = False
         self.tool_calls_made = 0
         self.max_tool_calls = 10
         self.completed = False
         self.incident_data = self._generate_incident()
-        self._populate_logs()
+        # JSON fragments for the fixed-shape responses below
+        self._alert_json = _dumps(self.incident_data["alert"])
+        self._correct_diagnosis_json = _dumps(self.incident_data["correct_diagnosis"])
+        self._correct_diagnosis_lower = self.incident_data["correct_diagnosis"].lower()
+        # (item, lowercased filter key) pairs for the environment lists the tools search
+        env_state = self.incident_data["environment"]
+        self._deps_idx = tuple((d, d["name"].lower()) for d in env_state["dependencies"])
+        self._slack_idx = tuple((m, m["content"].lower()) for m in env_state["slack_messages"])
+        self._deployments_idx = tuple((d, d["service"].lower()) for d in env_state["deployments"])
         self.system_prompt = self._get_default_system_prompt()
+        self._render_system_prompt()
+        self._actions = {
+            "get_initial_state": self.get_initial_state,
+            "get_tools": self.get_tools,
+            "get_system_prompt": self.get_system_prompt,
+            "update_system_prompt": self.update_system_prompt,
+            "use_tool": self.use_tool,
+            "submit_diagnosis": self.submit_diagnosis,
+        }
+        self._tool_handlers = {
+            "check_dependencies": self._tool_check_dependencies,
+            "check_slack": self._tool_check_slack,
+            "check_deployments": self._tool_check_deployments,
+            "query_logs": self._tool_query_logs,
+        }
     
+    def _ensure_logs_db(self):
+        """Create and fill the logs table the first time query_logs needs it"""
+        if self._logs_db_ready:
+            return
+        self._init_db()
+        self._populate_logs()
+        self._logs_db_ready = True
+
     def _init_db(self):
         self.ctx.storage.sql.exec("""
             CREATE TABLE IF NOT EXISTS logs (
@@ -26,175 +166,121 @@ class OnCallEnvironment(DurableObject):
         """)
     
     def _populate_logs(self):
+        """Insert the incident logs with as few exec calls as possible
+
+        Each exec is a round trip into the storage layer, so rows are sent as
+        multi-row INSERTs, chunked to stay under the DO bound-parameter limit.
+        """
         logs = self.incident_data["environment"]["logs"]
-        for log in logs:
-            self.ctx.storage.sql.exec(
-                "INSERT INTO logs (timestamp, level, service, message, metadata) VALUES (?, ?, ?, ?, ?)",
-                log.get("timestamp", ""),
-                log.get("level", ""),
-                log.get("service", ""),
-                log.get("message", ""),
-                json.dumps(log.get("metadata", {}))
-            )
+        for start in range(0, len(logs), _LOG_INSERT_BATCH_ROWS):
+            batch = logs[start:start + _LOG_INSERT_BATCH_ROWS]
+            params = []
+            for log in batch:
+                params.extend((
+                    log.get("timestamp", ""),
+                    log.get("level", ""),
+                    log.get("service", ""),
+                    log.get("message", ""),
+                    _dumps(log.get("metadata", {}))
+                ))
+            if len(batch) == _LOG_INSERT_BATCH_ROWS:
+                statement = _INSERT_LOGS_BATCH_SQL
+            else:
+                statement = _insert_logs_sql(len(batch))
+            self.ctx.storage.sql.exec(statement, *params)
 
     
     async def on_fetch(self, request):
         """Entry point for the DO
         Single RPC invocation for the Worker handler that takes the
         full request and parses it to call internal methods
+        Handlers get the raw body and only parse it if they need more than the action
         """
 
-        data = await request.json()
-        action = data.get("action")
-        
-        if action == "get_initial_state":
-            return await self.get_initial_state()
-        elif action == "get_tools":
-            return await self.get_tools()
-        elif action == "get_system_prompt":
-            return await self.get_system_prompt()
-        elif action == "update_system_prompt":
-            return await self.update_system_prompt(data.get("system_prompt"))
-        elif action == "use_tool":
-            return await self.use_tool(data)
-        elif action == "submit_diagnosis":
-            return await self.submit_diagnosis(data.get("diagnosis"))
-
-    async def get_system_prompt(self):
-        tools = self._get_tools_definitions()
-        tool_definitions = json.dumps(tools, indent=2)
-        formatted_prompt = self.system_prompt.replace("{TOOL_DEFINITIONS}", tool_definitions)
-
-        return Response(json.dumps({
-            "system_prompt": formatted_prompt
-        }))
-
-    async def update_system_prompt(self, new_prompt):
+        body = await request.text()
+        action = _extract_action(body)
+
+        action_handler = self._actions.get(action)
+        if action_handler is None:
+            return Response(_dumps({"error": f"Unknown action: {action}"}), status=400)
+        return await action_handler(body)
+
+    def _render_system_prompt(self):
+        """Substitute tool definitions into the prompt and cache the response body"""
+        self._rendered_system_prompt = self.system_prompt.replace("{TOOL_DEFINITIONS}", _TOOLS_DEFS_JSON_INDENTED)
+        self._system_prompt_response_body = _dumps({
+            "system_prompt": self._rendered_system_prompt
+        })
+
+    async def get_system_prompt(self, body):
+        return Response(self._system_prompt_response_body)
+
+    async def update_system_prompt(self, body):
+        new_prompt = _loads(body).get("system_prompt")
         if new_prompt:
             self.system_prompt = new_prompt
-            return Response(json.dumps({"status": "System prompt udpated"}))
+            self._render_system_prompt()
+            return Response(_dumps({"status": "System prompt udpated"}))
         else:
-            return Response(json.dumps({"error": "No system prompt provided"}), status=400)
+            return Response(_dumps({"error": "No system prompt provided"}), status=400)
 
     
-    async def get_initial_state(self):
-        return Response(json.dumps({
-            "incident_alert": self.incident_data["alert"],
-            "max_tool_calls": self.max_tool_calls,
-            "calls_remaining": self.max_tool_calls - self.tool_calls_made
-        }))
-
-    async def get_tools(self):
-        return Response(json.dumps({
-            "tools": self._get_tools_definitions()
-        }))
-
-    async def use_tool(self, data):
+    async def get_initial_state(self, body):
+        return Response(
+            f'{{"incident_alert": {self._alert_json}, '
+            f'"max_tool_calls": {self.max_tool_calls}, '
+            f'"calls_remaining": {self.max_tool_calls - self.tool_calls_made}}}'
+        )
+
+    async def get_tools(self, body):
+        return Response(_TOOLS_RESPONSE_BODY)
+
+    async def use_tool(self, body):
         if self.completed:
-            return Response(json.dumps({"error": "Environment completed"}), status=400)
+            return Response(_dumps({"error": "Environment completed"}), status=400)
         
         if self.tool_calls_made >= self.max_tool_calls:
-            return Response(json.dumps({"error": "Max tool calls exceeded"}), status=400)
+            return Response(_dumps({"error": "Max tool calls exceeded"}), status=400)
         
-        tool_call = data.get("tool_call", {})
+        tool_call = _loads(body).get("tool_call", {})
         tool_name = tool_call.get("name")
-        tool_args = tool_call.get("arguments", {})
+        tool_args = tool_call.get("arguments") or {}
         
         if not tool_name:
-            return Response(json.dumps({"error": "Missing tool name"}), status=400)
+            return Response(_dumps({"error": "Missing tool name"}), status=400)
         
         self.tool_calls_made += 1
         tool_response = self._execute_tool(tool_name, tool_args)
         
-        return Response(json.dumps({
-            "tool_response": tool_response,
-            "calls_remaining": self.max_tool_calls - self.tool_calls_made,
-            "call_number": self.tool_calls_made
-        }))
+        return Response(
+            f'{{"tool_response": {_dumps(tool_response)}, '
+            f'"calls_remaining": {self.max_tool_calls - self.tool_calls_made}, '
+            f'"call_number": {self.tool_calls_made}}}'
+        )
     
-    async def submit_diagnosis(self, diagnosis):
+    async def submit_diagnosis(self, body):
+        diagnosis = _loads(body).get("diagnosis")
         if self.completed:
-            return Response(json.dumps({"error": "Already completed"}), status=400)
+            return Response(_dumps({"error": "Already completed"}), status=400)
         
         self.completed = True
         
-        correct = diagnosis.lower() == self.incident_data["correct_diagnosis"].lower()
+        correct = diagnosis.lower() == self._correct_diagnosis_lower
         primary_reward = 2.0 if correct else 0.0
         efficiency_reward = max(0.0, 1.0 - (0.15 * (self.tool_calls_made - 1))) if correct else 0.0
         total_reward = primary_reward + efficiency_reward
         
-        return Response(json.dumps({
-            "correct": correct,
-            "correct_diagnosis": self.incident_data["correct_diagnosis"],
-            "agent_diagnosis": diagnosis,
-            "primary_reward": primary_reward,
-            "efficiency_reward": efficiency_reward,
-            "total_reward": total_reward,
-            "tool_calls_used": self.tool_calls_made,
-            "completed": True
-        }))
-
-    def _get_tools_definitions(self):
-        return [
-            {
-                "type": "function",
-                "name": "check_dependencies",
-                "description": "Check status of service dependencies",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "Optional: filter by service name"
-                        }
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "name": "check_slack", 
-                "description": "Search recent Slack messages from team members",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "Optional: search term to filter messages"
-                        }
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "name": "check_deployments",
-                "description": "Check recent deployment status and history",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "Optional: filter by service name"
-                        }
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "name": "query_logs",
-                "description": "Execute SQL query on logs database. Table schema: logs(id INTEGER, timestamp TEXT, level TEXT, service TEXT, message TEXT, metadata TEXT)",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "sql_query": {
-                            "type": "string",
-                            "description": "SQL SELECT query to execute against logs table. Use LIMIT to control result size."
-                        }
-                    },
-                    "required": ["sql_query"]
-                }
-            }
-        ]
-    
+        return Response(
+            f'{{"correct": {"true" if correct else "false"}, '
+            f'"correct_diagnosis": {self._correct_diagnosis_json}, '
+            f'"agent_diagnosis": {_dumps(diagnosis)}, '
+            f'"primary_reward": {primary_reward!r}, '
+            f'"efficiency_reward": {efficiency_reward!r}, '
+            f'"total_reward": {total_reward!r}, '
+            f'"tool_calls_used": {self.tool_calls_made}, '
+            f'"completed": true}}'
+        )
+
     def _get_default_system_prompt(self):
         return """You are an expert on-call engineer responsible for diagnosing production incidents quickly and accurately.
 
@@ -219,34 +305,34 @@ Remember: Accuracy is more important than speed, but efficiency is rewarded."""
 
     
     def _execute_tool(self, tool_name, args):
-        env_state = self.incident_data["environment"]
-        
-        if tool_name == "check_dependencies":
-            query = args.get("query", "")
-            deps = env_state["dependencies"]
-            if query:
-                deps = [d for d in deps if query.lower() in d["name"].lower()]
-            return {"dependencies": deps}
-        
-        elif tool_name == "check_slack":
-            query = args.get("query", "")
-            messages = env_state["slack_messages"]
-            if query:
-                messages = [m for m in messages if query.lower() in m["content"].lower()]
-            return {"messages": messages}
-        
-        elif tool_name == "check_deployments":
-            query = args.get("query", "")
-            deployments = env_state["deployments"]
-            if query:
-                deployments = [d for d in deployments if query.lower() in d["service"].lower()]
-            return {"deployments": deployments}
-        
-        elif tool_name == "query_logs":
-            return self._query_logs_db(args.get("sql_query", ""))
-        
-        else:
+        tool_handler = self._tool_handlers.get(tool_name)
+        if tool_handler is None:
             return {"error": f"Unknown tool: {tool_name}"}
+        return tool_handler(args)
+
+    def _tool_check_dependencies(self, args):
+        query = args.get("query")
+        if not query:
+            return {"dependencies": self.incident_data["environment"]["dependencies"]}
+        query = query.lower()
+        return {"dependencies": [d for d, key in self._deps_idx if query in key]}
+
+    def _tool_check_slack(self, args):
+        query = args.get("query")
+        if not query:
+            return {"messages": self.incident_data["environment"]["slack_messages"]}
+        query = query.lower()
+        return {"messages": [m for m, key in self._slack_idx if query in key]}
+
+    def _tool_check_deployments(self, args):
+        query = args.get("query")
+        if not query:
+            return {"deployments": self.incident_data["environment"]["deployments"]}
+        query = query.lower()
+        return {"deployments": [d for d, key in self._deployments_idx if query in key]}
+
+    def _tool_query_logs(self, args):
+        return self._query_logs_db(args.get("sql_query", ""))
     
     def _query_logs_db(self, sql_query):
         """Execute SQL query on logs table"""
@@ -254,34 +340,36 @@ Remember: Accuracy is more important than speed, but efficiency is rewarded."""
             return {"error": "No SQL query provided"}
 
         try:
-            if not sql_query.strip().upper().startswith("SELECT"):
+            if not _SELECT_RE.match(sql_query):
                 return {"error": "Only SELECT queries are allowed"}
 
+            self._ensure_logs_db()
             results = self.ctx.storage.sql.exec(sql_query).all()
+            total_found = len(results)
 
-            logs = []
-            for row in results:
-                logs.append({
+            # Only build (and parse metadata for) the rows that are returned
+            logs = [
+                {
                     "timestamp": row.timestamp,
                     "level": row.level,
                     "service": row.service,
                     "message": row.message,
-                    "metadata": json.loads(row.metadata) if row.metadata else {},
-                })
+                    "metadata": _loads(row.metadata) if row.metadata else {},
+                }
+                for row in islice(results, _MAX_LOG_RESULTS)
+            ]
 
-            total_found = len(logs)
-            if len(logs) > 50:
-                logs = logs[:50]
+            if total_found > _MAX_LOG_RESULTS:
                 return {
                     "logs": logs,
                     "total_found": total_found,
                     "query_executed": sql_query,
-                    "warning": f"Query returned {total_found} results, showing first 50. Consider adding additional filters (WHERE, LIMIT) to narrow results."
+                    "warning": f"Query returned {total_found} results, showing first {_MAX_LOG_RESULTS}. Consider adding additional filters (WHERE, LIMIT) to narrow results."
                 }
 
             return {
                 "logs": logs,
-                "total_found": len(logs),
+                "total_found": total_found,
                 "query_executed": sql_query
             }
 
@@ -326,8 +414,13 @@ async def on_fetch(request, env, ctx):
     res = await stub.fetch(
         request.url,
         method=request.method,
-        body=await request.text() if request.method in ["POST", "PATCH", "PUT"] else None,
-        headers=dict(request.headers)
+        # Pass the body stream through rather than buffering it into a string
+        body=request.body if request.method in _BODY_METHODS else None,
+        headers={
+            name: value
+            for name in _FORWARDED_HEADERS
+            if (value := request.headers.get(name)) is not None
+        }
     )
 
     return res
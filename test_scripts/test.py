@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 import requests
 import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Your local wrangler dev URL base
 WORKER_BASE_URL = "http://localhost:61825"
 
-def send_request(agent_id, action, **kwargs):
-    """Send request to the worker"""
+# One session per thread (requests.Session isn't thread-safe), each reusing its keep-alive connection
+_local = threading.local()
+
+def _get_session():
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+        session.headers["Content-Type"] = "application/json"
+    return session
+
+def send_request(agent_id, action, verbose=True, **kwargs):
+    """Send request to the worker
+
+    Pass verbose=False from worker threads so the raw response prints don't interleave.
+    """
     # Use agent-specific URL path for isolation
     worker_url = f"{WORKER_BASE_URL}/{agent_id}"
     
@@ -17,9 +32,10 @@ def send_request(agent_id, action, **kwargs):
     }
     
     try:
-        response = requests.post(worker_url, json=payload)
-        print(f" Response status: {response.status_code}")
-        print(f" Response text: {response.text[:200]}...")
+        response = _get_session().post(worker_url, json=payload)
+        if verbose:
+            print(f" Response status: {response.status_code}")
+            print(f" Response text: {response.text[:200]}...")
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -41,9 +57,15 @@ def test_oncall_environment():
     print("Testing OnCall Environment")
     print("=" * 50)
     
+    # Tests 1-3 are read-only and independent, so fetch them concurrently
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        fut_state = executor.submit(send_request, agent_id, "get_initial_state", verbose=False)
+        fut_tools = executor.submit(send_request, agent_id, "get_tools", verbose=False)
+        fut_prompt = executor.submit(send_request, agent_id, "get_system_prompt", verbose=False)
+    
     # Test 1: Get initial state
     print("\n1️⃣ Getting initial state...")
-    initial_state = send_request(agent_id, "get_initial_state")
+    initial_state = fut_state.result()
     if initial_state:
         print(f"Incident Alert: {initial_state['incident_alert']}")
         print(f"Max tool calls: {initial_state['max_tool_calls']}")
@@ -54,7 +76,7 @@ def test_oncall_environment():
     
     # Test 2: Get tools
     print("\n2️⃣ Getting available tools...")
-    tools_response = send_request(agent_id, "get_tools")
+    tools_response = fut_tools.result()
     if tools_response:
         tools = tools_response['tools']
         print(f"Found {len(tools)} tools:")
@@ -66,7 +88,7 @@ def test_oncall_environment():
     
     # Test 3: Get system prompt
     print("\n3️⃣ Getting system prompt...")
-    prompt_response = send_request(agent_id, "get_system_prompt")
+    prompt_response = fut_prompt.result()
     if prompt_response:
         prompt = prompt_response['system_prompt']
         print(f"System prompt length: {len(prompt)} characters")
@@ -1,40 +1,43 @@
 #!/usr/bin/env python3
-import requests
+import aiohttp
+import asyncio
 import json
 import os
-from openai import OpenAI
+import re
+from openai import AsyncOpenAI
 
 # Configuration
 WORKER_BASE_URL = "http://localhost:64666"  # Update to match your wrangler port
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+NUM_AGENTS = int(os.getenv("NUM_AGENTS", "1"))  # Agents to run concurrently
 
 if not OPENAI_API_KEY:
     print("Error: OPENAI_API_KEY environment variable not set")
     print("Set it with: export OPENAI_API_KEY=your_key_here")
     exit(1)
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
-def send_request(agent_id, action, **kwargs):
+async def send_request(session, agent_id, action, **kwargs):
     """Send request to the OnCall environment"""
     worker_url = f"{WORKER_BASE_URL}/{agent_id}"
     payload = {"action": action, **kwargs}
     
     try:
-        response = requests.post(worker_url, json=payload)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        async with session.post(worker_url, json=payload) as response:
+            response.raise_for_status()
+            return json.loads(await response.text())
+    except aiohttp.ClientError as e:
         print(f"Request failed: {e}")
         return None
     except json.JSONDecodeError as e:
         print(f"JSON decode error: {e}")
         return None
 
-def call_llm(messages):
+async def call_llm(messages):
     """Call OpenAI LLM with messages"""
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4o-mini",
             messages=messages,
             temperature=0.1,
@@ -46,46 +49,34 @@ def call_llm(messages):
         print(f"LLM call failed: {e}")
         return None
 
+_TOOL_RE = re.compile(r"(check_dependencies|check_slack|check_deployments|query_logs)", re.IGNORECASE)
+
+# Arguments sent for each tool the LLM can name
+_TOOL_ARGUMENTS = {
+    "check_dependencies": {},
+    "check_slack": {},
+    "check_deployments": {},
+    # Simple SQL query extraction
+    "query_logs": {
+        "sql_query": "SELECT * FROM logs WHERE level = 'ERROR' ORDER BY timestamp DESC LIMIT 5"
+    },
+}
+
 def parse_tool_call(llm_response):
     """Extract tool call from LLM response"""
     print("llm response try to parse tool call: ", llm_response)
-    # Look for tool call patterns in the response
-    lines = llm_response.lower().split('\n')
-    
-    for line in lines:
-        if 'check_dependencies' in line:
-            return {
-                "name": "check_dependencies",
-                "arguments": {}
-            }
-        elif 'check_slack' in line:
-            return {
-                "name": "check_slack", 
-                "arguments": {}
-            }
-        elif 'check_deployments' in line:
-            return {
-                "name": "check_deployments",
-                "arguments": {}
-            }
-        elif 'query_logs' in line:
-            # Simple SQL query extraction
-            return {
-                "name": "query_logs",
-                "arguments": {
-                    "sql_query": "SELECT * FROM logs WHERE level = 'ERROR' ORDER BY timestamp DESC LIMIT 5"
-                }
-            }
-    
+    # Look for the first tool name mentioned in the response
+    match = _TOOL_RE.search(llm_response)
     # Default to checking dependencies if no clear tool call found
+    name = match.group(1).lower() if match else "check_dependencies"
     return {
-        "name": "check_dependencies",
-        "arguments": {}
+        "name": name,
+        "arguments": dict(_TOOL_ARGUMENTS[name])
     }
 
-def test_llm_oncall_integration():
-    """Test LLM integration with OnCall environment"""
-    agent_id = f"llm-agent-{int(os.urandom(4).hex(), 16)}"  # Random agent ID
+async def run_agent(session):
+    """Run one LLM agent against its own OnCall environment"""
+    agent_id = f"llm-agent-{os.urandom(4).hex()}"  # Random agent ID
     
     print("Testing LLM Integration with OnCall Environment")
     print("=" * 60)
@@ -93,7 +84,7 @@ def test_llm_oncall_integration():
     
     # Step 1: Initialize environment and get system prompt
     print("\n1. Initializing OnCall environment...")
-    initial_state = send_request(agent_id, "get_initial_state")
+    initial_state = await send_request(session, agent_id, "get_initial_state")
     if not initial_state:
         print("Failed to initialize environment")
         return
@@ -104,7 +95,7 @@ def test_llm_oncall_integration():
     
     # Step 2: Get system prompt
     print("\n2. Getting system prompt...")
-    prompt_response = send_request(agent_id, "get_system_prompt")
+    prompt_response = await send_request(session, agent_id, "get_system_prompt")
     if not prompt_response:
         print("Failed to get system prompt")
         return
@@ -119,7 +110,7 @@ def test_llm_oncall_integration():
         {"role": "user", "content": "I need you to help diagnose this incident. Start by checking the dependency statuses to understand what services might be affected. Please tell me which tool you want to use and I'll execute it for you."}
     ]
     
-    llm_response = call_llm(messages)
+    llm_response = await call_llm(messages)
     if not llm_response:
         print("LLM call failed")
         return
@@ -134,7 +125,7 @@ def test_llm_oncall_integration():
     
     # Step 5: Execute the tool
     print("\n5. Executing tool call...")
-    tool_response = send_request(agent_id, "use_tool", tool_call=tool_call)
+    tool_response = await send_request(session, agent_id, "use_tool", tool_call=tool_call)
     if not tool_response:
         print("Tool execution failed")
         return
@@ -163,18 +154,23 @@ def test_llm_oncall_integration():
         "content": f"Here are the results from the {tool_call['name']} tool: {json.dumps(tool_response['tool_response'], indent=2)}. Based on this information, what should be our next step in diagnosing the incident?"
     })
     
-    final_analysis = call_llm(messages)
+    final_analysis = await call_llm(messages)
     if final_analysis:
         print("LLM Analysis:")
         print(f"   {final_analysis}")
     
     print(f"\nTest completed. Tool calls used: {11 - tool_response['calls_remaining']}/10")
 
+async def test_llm_oncall_integration(num_agents=NUM_AGENTS):
+    """Test LLM integration with OnCall environment, one environment per agent"""
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(run_agent(session) for _ in range(num_agents)))
+
 if __name__ == "__main__":
     print("Starting LLM OnCall Integration Test...")
     print("Make sure your worker is running and OPENAI_API_KEY is set")
     print()
     
-    test_llm_oncall_integration()
+    asyncio.run(test_llm_oncall_integration())
     
     print("\nLLM integration test completed!")
@@ -1,11 +1,7 @@
 #!/usr/bin/env python3
-import requests
-import json
 import os
-from openai import OpenAI
 
-# Configuration
-WORKER_BASE_URL = "http://localhost:64666"  # Update to match your wrangler port
+# Check the key before importing the HTTP and OpenAI clients so a missing key exits immediately
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 if not OPENAI_API_KEY:
@@ -13,49 +9,210 @@ if not OPENAI_API_KEY:
     print("Set it with: export OPENAI_API_KEY=your_key_here")
     exit(1)
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+import aiohttp
+import asyncio
+import functools
+import hashlib
+import json
+import random
+import shelve
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessage
+
+try:
+    import orjson
+
+    def _dumps(obj, sort_keys=False):
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else None).decode()
+
+    _encode = orjson.dumps  # bytes, for request bodies
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj, sort_keys=False):
+        return json.dumps(obj, sort_keys=sort_keys)
+
+    def _encode(obj):
+        return json.dumps(obj).encode()
+
+    _loads = json.loads
 
-def send_request(agent_id, action, **kwargs):
-    """Send request to the OnCall environment"""
+# Configuration
+WORKER_BASE_URL = "http://localhost:64666"  # Update to match your wrangler port
+POOL_MAXSIZE = 32  # Keep-alive connections held open across the run
+POOL_MAXSIZE_PER_HOST = 16
+HEADERS = {"Content-Type": "application/json", "Connection": "keep-alive"}
+LLM_MODEL = "gpt-4o"  # Supports automatic prompt-prefix caching
+LLM_TEMPERATURE = 0.1
+LLM_CACHE_PATH = os.getenv("LLM_CACHE")  # Optional shelve file for reusing LLM replies across runs
+LLM_MAX_RETRIES = 3  # Retried by the OpenAI SDK with its own backoff
+RETRY_ATTEMPTS = 3  # Per worker request, for connection errors and timeouts (see send_request)
+RETRY_BASE_DELAY = 0.2  # Seconds; doubles per attempt, with full jitter
+RETRY_MAX_DELAY = 2.0
+CIRCUIT_BREAKER_THRESHOLD = 5  # Consecutive failed requests before giving up on the worker
+# Safe to replay after a dropped connection or read timeout; other actions change server state
+READ_ONLY_ACTIONS = {"get_initial_state", "get_system_prompt", "get_tools"}
+
+_consecutive_failures = 0
+
+@functools.lru_cache(maxsize=None)
+def _get_client():
+    """OpenAI client, created on first use"""
+    return AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=LLM_MAX_RETRIES)
+
+async def send_request(session, agent_id, action, with_raw=False, **kwargs):
+    """Send request to the OnCall environment
+
+    With with_raw, returns (parsed, raw_text) so callers can forward the body as-is.
+    Failures are retried with jittered exponential backoff. Read-only actions retry on
+    any connection error or timeout; state-changing actions (use_tool, submit_diagnosis)
+    only when the connection was never made, since the worker may already have run them.
+    """
+    global _consecutive_failures
     worker_url = f"{WORKER_BASE_URL}/{agent_id}"
     payload = {"action": action, **kwargs}
+    failed = (None, None) if with_raw else None
+    if action in READ_ONLY_ACTIONS:
+        retryable = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+    else:
+        retryable = aiohttp.ClientConnectorError
     
-    try:
-        response = requests.post(worker_url, json=payload)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Request failed: {e}")
-        return None
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
-        return None
+    if _consecutive_failures >= CIRCUIT_BREAKER_THRESHOLD:
+        print(f"Request skipped: worker unreachable after {_consecutive_failures} consecutive failures")
+        return failed
+    
+    for attempt in range(1, RETRY_ATTEMPTS + 1):
+        try:
+            async with session.post(worker_url, data=_encode(payload)) as response:
+                response.raise_for_status()
+                # Both orjson and json parse bytes directly, skipping a str decode
+                body = await response.read()
+                data = _loads(body)
+            _consecutive_failures = 0
+            return (data, body.decode()) if with_raw else data
+        except retryable as e:
+            if attempt == RETRY_ATTEMPTS:
+                print(f"Request failed after {attempt} attempts: {e}")
+                _consecutive_failures += 1
+                return failed
+            delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            await asyncio.sleep(random.uniform(0, delay))
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            # Not replayed: the worker may have applied the request before the connection dropped
+            print(f"Request failed: {e}")
+            _consecutive_failures += 1
+            return failed
+        except aiohttp.ClientError as e:
+            print(f"Request failed: {e}")
+            return failed
+        except json.JSONDecodeError as e:
+            print(f"JSON decode error: {e}")
+            return failed
+
+async def call_llm(messages, tools=None, tool_choice="auto", on_tool_call=None):
+    """Call OpenAI LLM with messages and optional tools
 
-def call_llm(messages, tools=None):
-    """Call OpenAI LLM with messages and optional tools"""
+    The completion is streamed. on_tool_call(index, tool_call) fires as soon as
+    each tool call's arguments are complete, before the rest of the reply arrives.
+    """
     try:
         params = {
-            "model": "gpt-4",
+            "model": LLM_MODEL,
             "messages": messages,
-            "temperature":0.1,
-            "max_tokens":500
+            "temperature": LLM_TEMPERATURE,
+            "max_tokens":500,
+            "stream": True
         }
         
         if tools:
             params["tools"] = tools
-            params["tool_choice"] = "auto"
+            params["tool_choice"] = tool_choice
+        
+        content_parts = []
+        tool_calls = []  # Streamed in index order, arguments arrive as fragments
+        
+        def finish_tool_call(index):
+            if on_tool_call is None:
+                return
+            call = tool_calls[index]
+            try:
+                arguments = _loads("".join(call["arguments"]))
+            except json.JSONDecodeError:
+                return  # Leave it to parse_tool_calls on the assembled message
+            on_tool_call(index, {"name": call["name"], "arguments": arguments})
+        
+        async for chunk in await _get_client().chat.completions.create(**params):
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content_parts.append(delta.content)
+            for fragment in delta.tool_calls or ():
+                if fragment.index == len(tool_calls):
+                    # A new index means every earlier call has its full arguments
+                    if tool_calls:
+                        finish_tool_call(len(tool_calls) - 1)
+                    tool_calls.append({"id": fragment.id, "name": "", "arguments": []})
+                call = tool_calls[fragment.index]
+                if fragment.function and fragment.function.name:
+                    call["name"] += fragment.function.name
+                if fragment.function and fragment.function.arguments:
+                    call["arguments"].append(fragment.function.arguments)
+        if tool_calls:
+            finish_tool_call(len(tool_calls) - 1)
         
-        response = client.chat.completions.create(**params)
-        return response.choices[0].message
+        return ChatCompletionMessage.model_validate({
+            "role": "assistant",
+            "content": "".join(content_parts) or None,
+            "tool_calls": [
+                {
+                    "id": call["id"],
+                    "type": "function",
+                    "function": {"name": call["name"], "arguments": "".join(call["arguments"])}
+                }
+                for call in tool_calls
+            ] or None
+        })
     except Exception as e:
         print(f"LLM call failed: {e}")
         return None
 
+def _hash(obj):
+    return hashlib.sha256(_dumps(obj, sort_keys=True).encode()).hexdigest()
+
+def _llm_cache_key(messages, tools, tool_choice):
+    """Exact-match key over everything that affects the completion"""
+    return _hash({
+        "model": LLM_MODEL,
+        "messages": messages,
+        "tools": tools,
+        "tool_choice": tool_choice,
+        "temperature": LLM_TEMPERATURE,
+    })
+
+async def cached_call_llm(messages, tools=None, tool_choice="auto", on_tool_call=None):
+    """call_llm backed by the LLM_CACHE shelve file when it is set
+
+    Cache hits return without calling on_tool_call.
+    """
+    if not LLM_CACHE_PATH:
+        return await call_llm(messages, tools=tools, tool_choice=tool_choice, on_tool_call=on_tool_call)
+    
+    key = _llm_cache_key(messages, tools, tool_choice)
+    with shelve.open(LLM_CACHE_PATH) as cache:
+        cached = cache.get(key)
+        if cached is not None:
+            print("LLM cache hit")
+            return ChatCompletionMessage.model_validate_json(cached)
+        
+        message = await call_llm(messages, tools=tools, tool_choice=tool_choice, on_tool_call=on_tool_call)
+        if message is not None:
+            cache[key] = message.model_dump_json()
+        return message
+
 def convert_tools_to_openai_format(oncall_tools):
     """Convert OnCall tools format to OpenAI tools format"""
-    openai_tools = []
-    for tool in oncall_tools:
-        openai_tool = {
+    return [
+        {
             "type": "function",
             "function": {
                 "name": tool["name"],
@@ -63,24 +220,57 @@ def convert_tools_to_openai_format(oncall_tools):
                 "parameters": tool["parameters"]
             }
         }
-        openai_tools.append(openai_tool)
-    return openai_tools
+        for tool in oncall_tools
+    ]
 
 def parse_tool_calls(llm_message):
     """Extract tool calls from LLM message"""
-    if hasattr(llm_message, 'tool_calls') and llm_message.tool_calls:
-        tool_calls = []
-        for tool_call in llm_message.tool_calls:
-            tool_calls.append({
-                "name": tool_call.function.name,
-                "arguments": json.loads(tool_call.function.arguments)
-            })
-        return tool_calls
-    return None
-
-def test_llm_oncall_integration():
+    tool_calls = getattr(llm_message, "tool_calls", None)
+    if not tool_calls:
+        return None
+    return [
+        {
+            "name": tool_call.function.name,
+            "arguments": _loads(tool_call.function.arguments)
+        }
+        for tool_call in tool_calls
+    ]
+
+def _fmt_deps(result):
+    deps = result['dependencies']
+    yield f"   Dependencies found: {len(deps)}"
+    for dep in deps:
+        yield f"     - {dep['name']}: {dep['status']} ({dep['response_time']})"
+
+def _fmt_logs(result):
+    logs = result.get('logs', [])
+    yield f"   Logs found: {len(logs)}"
+    for log in logs[:3]:  # Show first 3
+        yield f"     - {log['timestamp']}: {log['level']} - {log['message']}"
+
+def _fmt_slack(result):
+    messages_found = result['messages']
+    yield f"   Slack messages: {len(messages_found)}"
+    for msg in messages_found:
+        yield f"     - {msg['user']}: {msg['content']}"
+
+def _fmt_deploys(result):
+    deployments = result['deployments']
+    yield f"   Deployments: {len(deployments)}"
+    for dep in deployments:
+        yield f"     - {dep['service']}: {dep['status']} at {dep['timestamp']}"
+
+# Display lines for each tool's result, keyed by tool name
+FORMATTERS = {
+    "check_dependencies": _fmt_deps,
+    "query_logs": _fmt_logs,
+    "check_slack": _fmt_slack,
+    "check_deployments": _fmt_deploys,
+}
+
+async def test_llm_oncall_integration(session):
     """Test LLM integration with OnCall environment"""
-    agent_id = f"llm-agent-{int(os.urandom(4).hex(), 16)}"  # Random agent ID
+    agent_id = f"llm-agent-{os.urandom(4).hex()}"  # Random agent ID
     
     print("Testing LLM Integration with OnCall Environment")
     print("=" * 60)
@@ -88,7 +278,12 @@ def test_llm_oncall_integration():
     
     # Step 1: Initialize environment and get system prompt
     print("\n1. Initializing OnCall environment...")
-    initial_state = send_request(agent_id, "get_initial_state")
+    # The setup calls don't depend on each other, so issue them together
+    initial_state, prompt_response, tools_response = await asyncio.gather(
+        send_request(session, agent_id, "get_initial_state"),
+        send_request(session, agent_id, "get_system_prompt"),
+        send_request(session, agent_id, "get_tools"),
+    )
     if not initial_state:
         print("Failed to initialize environment")
         return
@@ -99,15 +294,13 @@ def test_llm_oncall_integration():
     
     # Step 2: Get system prompt and tools
     print("\n2. Getting system prompt and tools...")
-    prompt_response = send_request(agent_id, "get_system_prompt")
-    tools_response = send_request(agent_id, "get_tools")
-    
     if not prompt_response or not tools_response:
         print("Failed to get system prompt or tools")
         return
     
     system_prompt = prompt_response['system_prompt']
     oncall_tools = tools_response['tools']
+    # Converted once and reused for every LLM call so the prompt prefix stays stable
     openai_tools = convert_tools_to_openai_format(oncall_tools)
     
     print(f"System prompt retrieved ({len(system_prompt)} chars)")
@@ -120,102 +313,123 @@ def test_llm_oncall_integration():
         {"role": "user", "content": "I need you to help diagnose this incident. Start by checking the dependency statuses to understand what services might be affected."}
     ]
     
-    llm_message = call_llm(messages, tools=openai_tools)
-    if not llm_message:
-        print("LLM call failed")
-        return
-    
-    print(f"LLM Response: {llm_message.content or 'No content, tool call made'}")
-    
-    # Step 4: Parse and execute tool calls
-    tool_calls = parse_tool_calls(llm_message)
-    if not tool_calls:
-        print("No tool calls detected in LLM response")
-        return
+    # Tool calls are dispatched while the LLM is still streaming the rest of its reply.
+    # Leaving the task group waits for every started tool, including on early returns.
+    pending_tools = {}
+    # Calls past the environment's budget would only come back "Max tool calls exceeded", so don't send them
+    skipped_tools = set()
     
-    print(f"\n4. Processing {len(tool_calls)} tool call(s)...")
+    async with asyncio.TaskGroup() as tool_group:
+        def start_tool(index, tool_call):
+            if len(pending_tools) >= initial_state['calls_remaining']:
+                skipped_tools.add(index)
+                return
+            print(f"Executing tool {index+1}: {tool_call['name']}")
+            pending_tools[index] = tool_group.create_task(
+                send_request(session, agent_id, "use_tool", with_raw=True, tool_call=tool_call)
+            )
+        
+        llm_message = await cached_call_llm(messages, tools=openai_tools, on_tool_call=start_tool)
+        if not llm_message:
+            print("LLM call failed")
+            return
+        
+        print(f"LLM Response: {llm_message.content or 'No content, tool call made'}")
+        
+        # Step 4: Parse and execute tool calls
+        tool_calls = parse_tool_calls(llm_message)
+        if not tool_calls:
+            print("No tool calls detected in LLM response")
+            return
+        
+        print(f"\n4. Processing {len(tool_calls)} tool call(s)...")
+        
+        # The LLM issued these in parallel, so run them concurrently over the shared session.
+        # Most already started mid-stream; cache hits and unparsed calls start here.
+        for i, tool_call in enumerate(tool_calls):
+            if i not in pending_tools and i not in skipped_tools:
+                start_tool(i, tool_call)
     
     tool_results = []
     for i, tool_call in enumerate(tool_calls):
-        print(f"Executing tool {i+1}: {tool_call['name']}")
+        # Collect each tool's report and write it in one go
+        lines = [f"Tool {i+1} result: {tool_call['name']}"]
         
-        tool_response = send_request(agent_id, "use_tool", tool_call=tool_call)
+        if i not in pending_tools:
+            lines.append(f"Tool call skipped for {tool_call['name']}: no tool calls remaining")
+            print("\n".join(lines))
+            continue
+        
+        tool_response, raw_response = pending_tools[i].result()
         if not tool_response:
-            print(f"Tool execution failed for {tool_call['name']}")
+            lines.append(f"Tool execution failed for {tool_call['name']}")
+            print("\n".join(lines))
             continue
         
         tool_results.append({
             "tool_call": tool_call,
-            "response": tool_response['tool_response']
+            "raw_response": raw_response
         })
         
-        print(f"   Calls remaining: {tool_response['calls_remaining']}")
+        lines.append(f"   Calls remaining: {tool_response['calls_remaining']}")
         
         # Display specific tool results
-        if tool_call['name'] == 'check_dependencies':
-            deps = tool_response['tool_response']['dependencies']
-            print(f"   Dependencies found: {len(deps)}")
-            for dep in deps:
-                print(f"     - {dep['name']}: {dep['status']} ({dep['response_time']})")
-        
-        elif tool_call['name'] == 'query_logs':
-            logs = tool_response['tool_response'].get('logs', [])
-            print(f"   Logs found: {len(logs)}")
-            for log in logs[:3]:  # Show first 3
-                print(f"     - {log['timestamp']}: {log['level']} - {log['message']}")
-        
-        elif tool_call['name'] == 'check_slack':
-            messages_found = tool_response['tool_response']['messages']
-            print(f"   Slack messages: {len(messages_found)}")
-            for msg in messages_found:
-                print(f"     - {msg['user']}: {msg['content']}")
-        
-        elif tool_call['name'] == 'check_deployments':
-            deployments = tool_response['tool_response']['deployments']
-            print(f"   Deployments: {len(deployments)}")
-            for dep in deployments:
-                print(f"     - {dep['service']}: {dep['status']} at {dep['timestamp']}")
+        formatter = FORMATTERS.get(tool_call['name'])
+        if formatter:
+            lines.extend(formatter(tool_response['tool_response']))
+        
+        print("\n".join(lines))
     
     # Step 5: Get LLM analysis of results
     print("\n5. Getting LLM analysis of tool results...")
     
-    # Add the assistant's message with tool calls
+    # Build the assistant's tool calls and the matching tool results in one pass
+    call_ids = [f"call_{i}" for i in range(len(tool_results))]
+    assistant_tool_calls = []
+    tool_messages = []
+    for call_id, result in zip(call_ids, tool_results):
+        assistant_tool_calls.append({
+            "id": call_id,
+            "type": "function", 
+            "function": {
+                "name": result["tool_call"]["name"],
+                "arguments": _dumps(result["tool_call"]["arguments"])
+            }
+        })
+        # Forward the worker's JSON body verbatim instead of re-encoding it
+        tool_messages.append({
+            "role": "tool",
+            "tool_call_id": call_id,
+            "content": result["raw_response"]
+        })
+    
     messages.append({
         "role": "assistant", 
         "content": llm_message.content,
-        "tool_calls": [
-            {
-                "id": f"call_{i}",
-                "type": "function", 
-                "function": {
-                    "name": tc["tool_call"]["name"],
-                    "arguments": json.dumps(tc["tool_call"]["arguments"])
-                }
-            }
-            for i, tc in enumerate(tool_results)
-        ]
+        "tool_calls": assistant_tool_calls
     })
+    messages.extend(tool_messages)
     
-    # Add tool results
-    for i, result in enumerate(tool_results):
-        messages.append({
-            "role": "tool",
-            "tool_call_id": f"call_{i}",
-            "content": json.dumps(result["response"])
-        })
-    
-    final_analysis = call_llm(messages)
+    # Resend the same tools so the cached system + tools prefix matches the first call;
+    # tool_choice="none" keeps this turn a text analysis
+    final_analysis = await cached_call_llm(messages, tools=openai_tools, tool_choice="none")
     if final_analysis:
         print("LLM Analysis:")
         print(f"   {final_analysis.content}")
     
-    print(f"\nTest completed. Tool calls used: {len(tool_calls)}")
+    print(f"\nTest completed. Tool calls used: {len(pending_tools)}")
+
+async def main():
+    # One session for the whole run so setup and tool calls share pooled connections
+    connector = aiohttp.TCPConnector(limit=POOL_MAXSIZE, limit_per_host=POOL_MAXSIZE_PER_HOST)
+    async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
+        await test_llm_oncall_integration(session)
 
 if __name__ == "__main__":
     print("Starting LLM OnCall Integration Test...")
     print("Make sure your worker is running and OPENAI_API_KEY is set")
     print()
     
-    test_llm_oncall_integration()
+    asyncio.run(main())
     
     print("\nLLM integration test completed!")